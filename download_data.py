@@ -3,19 +3,90 @@ import requests
 import os
 import zipfile
 import io
+import shutil
+import time
+import threading
+from urllib.parse import quote
+import google.auth.transport.requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from concurrent.futures import ThreadPoolExecutor, as_completed
 PROJECT_ID = 'formidable-code-280411' 
 
+# Downloads are IO-bound (GEE compositing + HTTPS), so fan them out over threads
+MAX_WORKERS = int(os.environ.get("LULC_DOWNLOAD_WORKERS", 8))
+
+# Shared session so TLS/TCP connections are reused across years.
+# Transient GEE errors (429/5xx) are retried with backoff instead of failing the year.
+SESSION = requests.Session()
+SESSION.headers.update({'Accept-Encoding': 'gzip, deflate'})
+SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=16,
+    max_retries=Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504])
+))
+
+# Chunk size used when streaming downloads to disk
+CHUNK_SIZE = 1024 * 1024
+
+# Optional Cloud Storage bucket. When set, images are exported with ee.batch
+# (asynchronous server-side compositing, Cloud-Optimized GeoTIFF output) and
+# then fetched from the bucket, instead of using the size-capped getDownloadURL.
+# Downloads are authenticated with the same OAuth credentials Earth Engine uses.
+GCS_BUCKET = os.environ.get("LULC_GCS_BUCKET")
+EXPORT_POLL_SECONDS = 15
+# Give up on (and cancel) an export that has not finished after this long
+EXPORT_TIMEOUT_SECONDS = int(os.environ.get("LULC_EXPORT_TIMEOUT", 3600))
+
+# Credentials Earth Engine was initialized with (set by init_gee), shared by all
+# download threads for Cloud Storage requests; the lock serializes token refreshes
+_EE_CREDENTIALS = None
+_CREDENTIALS_LOCK = threading.Lock()
+
 def init_gee():
-    """Initialize Google Earth Engine."""
+    """
+    Initialize Google Earth Engine.
+    The credentials are loaded here and passed to ee.Initialize explicitly, so the
+    Cloud Storage downloads authenticate as exactly the same account.
+    """
+    global _EE_CREDENTIALS
     try:
-        ee.Initialize(project=PROJECT_ID)
+        _EE_CREDENTIALS = ee.data.get_persistent_credentials()
+        ee.Initialize(_EE_CREDENTIALS, project=PROJECT_ID)
         print("Google Earth Engine initialized successfully.")
     except Exception as e:
         print("Google Earth Engine not authenticated. Triggering authentication...")
         ee.Authenticate()
-        ee.Initialize()
+        _EE_CREDENTIALS = ee.data.get_persistent_credentials()
+        ee.Initialize(_EE_CREDENTIALS)
         print("Google Earth Engine initialized successfully.")
 
+def gcs_auth_headers():
+    """
+    Bearer token header for Cloud Storage, using the credentials from init_gee().
+    The access token is refreshed when it has expired.
+    """
+    with _CREDENTIALS_LOCK:
+        if _EE_CREDENTIALS is None:
+            raise RuntimeError("Earth Engine credentials not loaded; call init_gee() first.")
+        if not _EE_CREDENTIALS.valid:
+            _EE_CREDENTIALS.refresh(google.auth.transport.requests.Request(session=SESSION))
+        return {'Authorization': f'Bearer {_EE_CREDENTIALS.token}'}
+
+def fetch_url(url, filename, headers=None):
+    """Stream a URL to disk through the shared session."""
+    with SESSION.get(url, headers=headers, stream=True, timeout=(10, 300)) as response:
+        if response.status_code == 200:
+            # Stream straight to disk instead of holding the whole GeoTIFF in memory
+            response.raw.decode_content = True
+            with open(filename, 'wb') as f:
+                shutil.copyfileobj(response.raw, f, length=CHUNK_SIZE)
+            print(f"Saved to {filename}")
+            return True
+        else:
+            print(f"Failed to download. Status: {response.status_code}")
+            return False
+
 def download_image(image, scale, region, filename):
     """Download an image from GEE using getDownloadURL."""
     try:
@@ -25,21 +96,108 @@ def download_image(image, scale, region, filename):
             'format': 'GEO_TIFF'
         })
         print(f"Downloading from: {url[:50]}...")
-        
-        response = requests.get(url)
-        
-        if response.status_code == 200:
-            with open(filename, 'wb') as f:
-                f.write(response.content)
-            print(f"Saved to {filename}")
-            return True
-        else:
-            print(f"Failed to download. Status: {response.status_code}")
+        return fetch_url(url, filename)
+    except Exception as e:
+        print(f"Error: {e}")
+        return False
+
+def export_image(image, scale, roi, name, bucket):
+    """Start an asynchronous GEE export of a Cloud-Optimized GeoTIFF to Cloud Storage."""
+    try:
+        task = ee.batch.Export.image.toCloudStorage(
+            image=image,
+            description=name,
+            bucket=bucket,
+            fileNamePrefix=name,
+            scale=scale,
+            region=roi,
+            fileFormat='GeoTIFF',
+            formatOptions={'cloudOptimized': True}
+        )
+        task.start()
+        return task
+    except Exception as e:
+        print(f"Error: {e}")
+        return None
+
+def download_export(task, bucket, name, filename):
+    """Wait for an export task to finish, then download its GeoTIFF from the bucket."""
+    if task is None:
+        return False
+    try:
+        deadline = time.monotonic() + EXPORT_TIMEOUT_SECONDS
+        while task.active():
+            if time.monotonic() >= deadline:
+                task.cancel()
+                print(f"Export {name} timed out after {EXPORT_TIMEOUT_SECONDS}s; task cancelled.")
+                return False
+            time.sleep(EXPORT_POLL_SECONDS)
+        status = task.status()
+        if status['state'] != 'COMPLETED':
+            print(f"Export {name} failed: {status.get('error_message', status['state'])}")
             return False
+        
+        url = f"https://storage.googleapis.com/{quote(bucket)}/{quote(name)}.tif"
+        print(f"Downloading from: {url[:50]}...")
+        return fetch_url(url, filename, headers=gcs_auth_headers())
     except Exception as e:
         print(f"Error: {e}")
         return False
 
+def build_collections(roi):
+    """
+    Build the year-invariant parts of the Sentinel-2 and Dynamic World chains once.
+    Per year only a date filter and the reducer are added on top.
+    """
+    s2_base = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED") \
+        .filterBounds(roi) \
+        .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 10)) \
+        .select(['B2', 'B3', 'B4', 'B8', 'B11']) # SWIR2 (B12) is not used downstream
+    
+    dw_base = ee.ImageCollection("GOOGLE/DYNAMICWORLD/V1") \
+        .filterBounds(roi) \
+        .select('label')
+    
+    return s2_base, dw_base
+
+def process_year(year, s2_base, dw_base, roi, region, output_dir):
+    """Download the Sentinel-2 composite and Dynamic World label for one year."""
+    print(f"\nProcessing Year: {year}")
+    
+    start_date = f'{year}-01-01'
+    end_date = f'{year}-12-31'
+    
+    s2 = s2_base \
+        .filterDate(start_date, end_date) \
+        .median() \
+        .clip(roi)
+        
+    dw = dw_base \
+        .filterDate(start_date, end_date) \
+        .mode() \
+        .clip(roi)
+    
+    s2_name = f"Sentinel2_{year}"
+    dw_name = f"LandCover_{year}"
+    s2_filename = os.path.join(output_dir, f"{s2_name}.tif")
+    dw_filename = os.path.join(output_dir, f"{dw_name}.tif")
+    
+    if GCS_BUCKET:
+        # Start both exports first so GEE composites them in parallel
+        print("Exporting Sentinel-2 image and Dynamic World label to Cloud Storage...")
+        s2_task = export_image(s2, 10, roi, s2_name, GCS_BUCKET)
+        dw_task = export_image(dw, 10, roi, dw_name, GCS_BUCKET)
+        ok_s2 = download_export(s2_task, GCS_BUCKET, s2_name, s2_filename)
+        ok_dw = download_export(dw_task, GCS_BUCKET, dw_name, dw_filename)
+    else:
+        print("Fetching Sentinel-2 image...")
+        ok_s2 = download_image(s2, 10, region, s2_filename)
+        
+        print("Fetching Dynamic World label...")
+        ok_dw = download_image(dw, 10, region, dw_filename)
+
+    return year, ok_s2, ok_dw
+
 def main():
     init_gee()
     
@@ -50,6 +208,7 @@ def main():
     point = ee.Geometry.Point([77.64, 13.05])
     roi = point.buffer(7500).bounds()
     region = roi.getInfo()['coordinates']
+    s2_base, dw_base = build_collections(roi)
     
     years = range(2018, 2026)
     
@@ -57,34 +216,12 @@ def main():
     print(f"Region: Bangalore (5km buffer)")
     print("-" * 50)
     
-    for year in years:
-        print(f"\nProcessing Year: {year}")
-        
-        start_date = f'{year}-01-01'
-        end_date = f'{year}-12-31'
-        
-        s2 = ee.ImageCollection("COPERNICUS/S2_SR_HARMONIZED") \
-            .filterBounds(roi) \
-            .filterDate(start_date, end_date) \
-            .filter(ee.Filter.lt('CLOUDY_PIXEL_PERCENTAGE', 10)) \
-            .median() \
-            .select(['B2', 'B3', 'B4', 'B8', 'B11', 'B12']) \
-            .clip(roi)
-            
-        s2_filename = os.path.join(output_dir, f"Sentinel2_{year}.tif")
-        print("Fetching Sentinel-2 image...")
-        download_image(s2, 10, region, s2_filename)
-        
-        dw = ee.ImageCollection("GOOGLE/DYNAMICWORLD/V1") \
-            .filterBounds(roi) \
-            .filterDate(start_date, end_date) \
-            .select('label') \
-            .mode() \
-            .clip(roi)
-            
-        dw_filename = os.path.join(output_dir, f"LandCover_{year}.tif")
-        print("Fetching Dynamic World label...")
-        download_image(dw, 10, region, dw_filename)
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        futures = [executor.submit(process_year, year, s2_base, dw_base, roi, region, output_dir) for year in years]
+        for future in as_completed(futures):
+            year, ok_s2, ok_dw = future.result()
+            print(f"Year {year} done: Sentinel-2 {'OK' if ok_s2 else 'FAILED'}, "
+                  f"Dynamic World {'OK' if ok_dw else 'FAILED'}")
 
     print("\n" + "="*50)
     print("All downloads complete!")
@@ -3,9 +3,17 @@ import rasterio
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-from sklearn.ensemble import RandomForestClassifier
-from scipy.ndimage import median_filter
+from PIL import Image
 import os
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+# Numba is optional and only imported the first time calculate_indices needs it
+# (the import alone costs ~0.3 s). Set USE_NUMBA = False to force the NumPy path.
+USE_NUMBA = True
+_INDICES_KERNEL = None # None: not built yet, False: numba unavailable
+prange = range # Replaced by numba.prange once numba is loaded
 
 # --- Configuration ---
 DATA_DIR = "data_v2"
@@ -38,105 +46,311 @@ COLORS = np.array([
     [1.00, 1.00, 1.00]  # Snow (White)
 ])
 
+# 8-bit colors and the flattened PNG palette, computed once at import
+COLORS_U8 = (COLORS * 255).astype(np.uint8)
+PALETTE = COLORS_U8.ravel().tolist()
+
+# PNG previews are capped at roughly this many pixels per side; TIFs stay full resolution
+MAX_PLOT_SIZE = 1500
+
+def display_stride(shape):
+    """Integer stride that brings a raster down to about MAX_PLOT_SIZE for previews."""
+    return max(1, max(shape[:2]) // MAX_PLOT_SIZE)
+
+# One figure is reused for every plot; creating a figure per call dominates small plots
+_FIG, _AX = plt.subplots(figsize=(10, 10))
+_DEFAULT_SUBPLOT_PARAMS = {k: matplotlib.rcParams[f'figure.subplot.{k}']
+                           for k in ('left', 'right', 'bottom', 'top', 'wspace', 'hspace')}
+
+def _reset_figure():
+    """Clear the shared axes and undo earlier tight_layout() calls so every plot starts like a new figure."""
+    _AX.clear()
+    _FIG.subplots_adjust(**_DEFAULT_SUBPLOT_PARAMS)
+
 def load_image(path):
     with rasterio.open(path) as src:
-        data = src.read()
-        # (Bands, H, W) -> (H, W, Bands)
-        data = np.moveaxis(data, 0, -1)
+        # Read straight into (H, W, Bands): GDAL writes through the transposed
+        # (Bands, H, W) view, so no moveaxis copy is needed afterwards
+        data = np.empty((src.height, src.width, src.count), dtype=np.float32)
+        src.read(indexes=list(range(1, src.count + 1)), out=data.transpose(2, 0, 1))
         return data, src.profile
 
+def cache_single_band(path, cache_path):
+    """
+    Decode band 1 of a GeoTIFF block by block into an (H, W) uint8 .npy file.
+    Only one block is decoded at a time, so memory does not grow with the raster.
+    """
+    tmp_path = cache_path + ".tmp"
+    with rasterio.open(path) as src:
+        cache = np.lib.format.open_memmap(tmp_path, mode='w+', dtype=np.uint8,
+                                          shape=(src.height, src.width))
+        for _, window in src.block_windows(1):
+            cache[window.toslices()] = src.read(1, window=window, out_dtype=np.uint8)
+        cache.flush()
+        profile = src.profile
+    del cache
+    # Only publish complete caches; a partial file would look fresh on the next run
+    os.replace(tmp_path, cache_path)
+    return profile
+
+def landcover_cache_path(path, year):
+    """Cache file for a label raster, keyed on the source path so data/ and data_v2/ never collide."""
+    key = hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:12]
+    return os.path.join(OUTPUT_DIR, f"lc_{year}_{key}.npy")
+
+def load_landcover(path, year):
+    """
+    Load a Dynamic World label raster as a read-only, memory-mapped (H, W) uint8 array.
+    The decoded array is cached in results/lc_{year}_<source hash>.npy and reused on
+    later runs as long as the cache is newer than the GeoTIFF and has its shape.
+    """
+    cache_path = landcover_cache_path(path, year)
+    if os.path.exists(cache_path) and os.path.getmtime(cache_path) >= os.path.getmtime(path):
+        # Only the header is parsed here, pixels come from the cache
+        with rasterio.open(path) as src:
+            profile = src.profile
+            shape = (src.height, src.width)
+        data = np.load(cache_path, mmap_mode='r')
+        if data.shape == shape:
+            return data, profile
+        del data
+    
+    profile = cache_single_band(path, cache_path)
+    return np.load(cache_path, mmap_mode='r'), profile
+
+def count_classes(lc_data, rows_per_chunk=512):
+    """
+    Pixel count per class of a uint8 label array.
+    bincount widens its input to intp, so counting runs over row chunks to keep
+    that temporary small (and only touch a few pages of a memory-mapped cache at once).
+    """
+    counts = np.zeros(256, dtype=np.int64)
+    for start in range(0, lc_data.shape[0], rows_per_chunk):
+        counts += np.bincount(lc_data[start:start + rows_per_chunk].ravel(), minlength=256)
+    return counts[:len(CLASSES)]
+
+def _indices_loop(img, out):
+    """Single pass per pixel: copy the bands and append NDVI, NDBI, MNDWI."""
+    epsilon = np.float32(1e-8)
+    H, W, n_bands = img.shape
+    for i in prange(H):
+        for j in range(W):
+            for k in range(n_bands):
+                out[i, j, k] = img[i, j, k]
+            green = img[i, j, 1]
+            red   = img[i, j, 2]
+            nir   = img[i, j, 3]
+            swir1 = img[i, j, 4]
+            out[i, j, n_bands]     = (nir - red) / (nir + red + epsilon)
+            out[i, j, n_bands + 1] = (swir1 - nir) / (swir1 + nir + epsilon)
+            out[i, j, n_bands + 2] = (green - swir1) / (green + swir1 + epsilon)
+
+def _get_indices_kernel():
+    """JIT-compile _indices_loop on first use; returns None when numba is disabled or missing."""
+    global _INDICES_KERNEL, prange
+    if not USE_NUMBA:
+        return None
+    if _INDICES_KERNEL is None:
+        try:
+            import numba
+        except ImportError:
+            _INDICES_KERNEL = False
+        else:
+            prange = numba.prange
+            _INDICES_KERNEL = numba.njit(parallel=True, fastmath=True, cache=True)(_indices_loop)
+    return _INDICES_KERNEL or None
+
 def calculate_indices(img):
     """
     Calculate spectral indices to improve classification accuracy.
-    Input: (H, W, 6) -> [Blue, Green, Red, NIR, SWIR1, SWIR2]
+    Input: (H, W, 5) -> [Blue, Green, Red, NIR, SWIR1]
+    (older 6-band downloads with a trailing SWIR2 band also work)
+    Output: (H, W, bands + 3) float32 -> bands + [NDVI, NDBI, MNDWI]
     """
     # Avoid division by zero
     epsilon = 1e-8
     
-    blue  = img[:, :, 0]
+    # Work in float32 and write straight into the output stack (no dstack copy)
+    img = np.ascontiguousarray(img, dtype=np.float32)
+    n_bands = img.shape[2]
+    features = np.empty(img.shape[:2] + (n_bands + 3,), dtype=np.float32)
+    
+    kernel = _get_indices_kernel()
+    if kernel is not None:
+        kernel(img, features)
+        return features
+    
+    features[..., :n_bands] = img
+    
     green = img[:, :, 1]
     red   = img[:, :, 2]
     nir   = img[:, :, 3]
     swir1 = img[:, :, 4]
     
+    # Scratch buffer for the denominators
+    tmp = np.empty(img.shape[:2], dtype=np.float32)
+    
+    def normalized_difference(a, b, out):
+        np.subtract(a, b, out=out)
+        np.add(a, b, out=tmp)
+        np.add(tmp, epsilon, out=tmp)
+        np.divide(out, tmp, out=out)
+    
     # NDVI (Vegetation)
-    ndvi = (nir - red) / (nir + red + epsilon)
+    normalized_difference(nir, red, features[..., n_bands])
     
     # NDBI (Built-up)
-    ndbi = (swir1 - nir) / (swir1 + nir + epsilon)
+    normalized_difference(swir1, nir, features[..., n_bands + 1])
     
     # MNDWI (Water)
-    mndwi = (green - swir1) / (green + swir1 + epsilon)
+    normalized_difference(green, swir1, features[..., n_bands + 2])
     
-    # Stack features: Original 6 bands + 3 indices
-    features = np.dstack([img, ndvi, ndbi, mndwi])
     return features
 
-def save_plot(data, title, filename, rgb_img=None):
-    plt.figure(figsize=(10, 10))
+def quantize_features(features, n_indices=3, reflectance_scale=10000.0):
+    """
+    Quantize a calculate_indices() stack to int8 for compact classifier input.
+    Reflectance bands (0..reflectance_scale) use the full -128..127 range via an offset,
+    indices (-1..1) map to -127..127; values outside those ranges saturate.
+    Returns (features_i8, scale, offset) with features ~= (features_i8 - offset) / scale per channel.
+    """
+    n_bands = features.shape[2] - n_indices
+    scale = np.full(features.shape[2], 127.0, dtype=np.float32)
+    offset = np.zeros(features.shape[2], dtype=np.float32)
+    scale[:n_bands] = 255.0 / reflectance_scale
+    offset[:n_bands] = -128.0
     
-    if rgb_img is not None:
-        # Display RGB Composite (Red, Green, Blue) -> Indices 2, 1, 0
-        display_data = np.dstack([rgb_img[:,:,2], rgb_img[:,:,1], rgb_img[:,:,0]])
-        
-        # Normalize 0-1 for display
-        p2, p98 = np.percentile(display_data, (2, 98))
-        display_data = np.clip((display_data - p2) / (p98 - p2), 0, 1)
-        
-        plt.imshow(display_data)
-    else:
-        from matplotlib.colors import ListedColormap
-        cmap = ListedColormap(COLORS)
-        plt.imshow(data, cmap=cmap, vmin=0, vmax=8, interpolation='nearest')
+    scaled = features * scale
+    scaled += offset
+    np.rint(scaled, out=scaled)
+    np.clip(scaled, -128, 127, out=scaled)
+    return scaled.astype(np.int8), scale, offset
+
+def save_plot(rgb_img, title, filename):
+    _reset_figure()
+    
+    # Display RGB Composite (Red, Green, Blue) -> Indices 2, 1, 0
+    stride = display_stride(rgb_img.shape)
+    display_data = rgb_img[::stride, ::stride, [2, 1, 0]].astype(np.float32, copy=False)
+    
+    # Normalize 0-1 for display; the stretch limits are estimated on a strided subsample
+    p2, p98 = np.quantile(display_data[::4, ::4], [0.02, 0.98], method='lower')
+    np.subtract(display_data, p2, out=display_data)
+    np.multiply(display_data, 1.0 / (p98 - p2), out=display_data)
+    np.clip(display_data, 0, 1, out=display_data)
+    
+    _AX.imshow(display_data)
+
+    _AX.set_title(title)
+    _AX.axis('off')
+    _FIG.tight_layout()
+    _FIG.savefig(os.path.join(OUTPUT_DIR, filename), dpi=150, bbox_inches='tight')
+
+def save_map(lc_data, filename):
+    """
+    Write a land cover map as a palette PNG (one pixel per raster cell, strided for very large rasters).
+    Class ids are stored directly as palette indices, so encoding works on 1 byte per pixel.
+    """
+    stride = display_stride(lc_data.shape)
+    img = Image.fromarray(np.ascontiguousarray(lc_data[::stride, ::stride], dtype=np.uint8))
+    img.putpalette(PALETTE)
+    img.save(os.path.join(OUTPUT_DIR, filename), format='PNG', optimize=True)
+
+def save_legend(filename):
+    """Render the class legend shared by all map_{year}.png files."""
+    fig = plt.figure(figsize=(3, 3))
+    patches = [plt.Rectangle((0,0),1,1, color=COLORS[i]) for i in range(9)]
+    fig.legend(patches, CLASSES.values(), loc='center', title="Land Cover")
+    fig.savefig(os.path.join(OUTPUT_DIR, filename), dpi=150, bbox_inches='tight')
+    plt.close(fig)
+
+def landcover_path(year):
+    return os.path.join(DATA_DIR, f"LandCover_{year}.tif")
+
+def process_year_analysis(year, gdal_threads=1):
+    """
+    Process one year: urban statistics, map/satellite PNGs and classification GeoTIFF.
+    Runs in a worker process; gdal_threads is that worker's share of the cores for
+    GeoTIFF compression. Returns (year, urban_pct) or None if data is missing.
+    """
+    lc_path = landcover_path(year)
+    s2_path = os.path.join(DATA_DIR, f"Sentinel2_{year}.tif")
+    
+    if not os.path.exists(lc_path):
+        print(f"Skipping Year {year}: Data not found.")
+        return None
         
-        patches = [plt.Rectangle((0,0),1,1, color=COLORS[i]) for i in range(9)]
-        plt.legend(patches, CLASSES.values(), loc='center left', bbox_to_anchor=(1, 0.5))
+    print(f"   Processing Year {year}...")
+    
+    # Load Land Cover (Ground Truth)
+    # Dynamic World labels are already classified!
+    lc_data, profile = load_landcover(lc_path, year)
+    
+    # Single pass histogram of every class; Urban Area is Class 6
+    class_counts = count_classes(lc_data)
+    urban_pixels = int(class_counts[6])
+    urban_pct = (urban_pixels / lc_data.size) * 100
+    print(f"     -> Urban Coverage ({year}): {urban_pct:.2f}%")
+    
+    save_map(lc_data, f"map_{year}.png")
+    
+    # Save RGB Reference (if available)
+    if os.path.exists(s2_path):
+        raw_img, _ = load_image(s2_path)
+        save_plot(raw_img, f"Satellite Image {year}", f"satellite_{year}.png")
+    
+    # Keep the source's tiling and DEFLATE compression (Dynamic World exports are
+    # already tiled 256x256); no predictor, since differencing class ids only adds entropy
+    profile.update(count=1, dtype=rasterio.uint8, num_threads=gdal_threads)
+    profile.setdefault('compress', 'deflate')
+    with rasterio.open(os.path.join(OUTPUT_DIR, f"classification_{year}.tif"), 'w', **profile) as dst:
+        dst.write(lc_data.astype(rasterio.uint8, copy=False), 1)
+    
+    return year, urban_pct
 
-    plt.title(title)
-    plt.axis('off')
-    plt.tight_layout()
-    plt.savefig(os.path.join(OUTPUT_DIR, filename), dpi=150, bbox_inches='tight')
-    plt.close()
+def compute_change_map(start_path, end_path):
+    """
+    New urban pixels (not Built Area at the start, Built Area at the end) as a
+    0/1 uint8 preview, equal to the full-resolution mask sliced with display_stride().
+    Both classifications are streamed block by block and only the strided pixels
+    are kept, so memory is one tile per year plus the preview, whatever the ROI size.
+    """
+    with rasterio.open(start_path) as src_start, rasterio.open(end_path) as src_end:
+        stride = display_stride((src_start.height, src_start.width))
+        change_map = np.empty((-(-src_start.height // stride), -(-src_start.width // stride)),
+                              dtype=np.uint8)
+        for _, window in src_start.block_windows(1):
+            row_off, col_off = int(window.row_off), int(window.col_off)
+            # Pixels in this window that land on the preview grid
+            rows = slice(-row_off % stride, None, stride)
+            cols = slice(-col_off % stride, None, stride)
+            lc_start = src_start.read(1, window=window)[rows, cols]
+            lc_end = src_end.read(1, window=window)[rows, cols]
+            
+            new_urban = lc_end == 6
+            np.logical_and(new_urban, lc_start != 6, out=new_urban)
+            
+            # First preview row/column covered by the window
+            top, left = -(-row_off // stride), -(-col_off // stride)
+            change_map[top:top + new_urban.shape[0], left:left + new_urban.shape[1]] = new_urban
+    return change_map
 
 def analyze_data():
     print("Starting Analysis Pipeline (Using Ground Truth Data)...")
     
-    urban_stats = []
     years = range(2018, 2026)
     
     os.makedirs(OUTPUT_DIR, exist_ok=True)
+    save_legend("map_legend.png")
     
-    for year in years:
-        lc_path = os.path.join(DATA_DIR, f"LandCover_{year}.tif")
-        s2_path = os.path.join(DATA_DIR, f"Sentinel2_{year}.tif")
-        
-        if not os.path.exists(lc_path):
-            print(f"Skipping Year {year}: Data not found.")
-            continue
-            
-        print(f"   Processing Year {year}...")
-        
-        # Load Land Cover (Ground Truth)
-        # Dynamic World labels are already classified!
-        lc_data, profile = load_image(lc_path)
-        lc_data = lc_data.squeeze() # (H, W)
-        
-        # Calculate only Urban Area (Class 6) - I can find for other classes as well
-        urban_pixels = np.sum(lc_data == 6)
-        urban_pct = (urban_pixels / lc_data.size) * 100
-        urban_stats.append((year, urban_pct))
-        print(f"     -> Urban Coverage: {urban_pct:.2f}%")
-        
-        save_plot(lc_data, f"LULC Classification {year}", f"map_{year}.png")
-        
-        # Save RGB Reference (if available)
-        if os.path.exists(s2_path):
-            raw_img, _ = load_image(s2_path)
-            save_plot(None, f"Satellite Image {year}", f"satellite_{year}.png", rgb_img=raw_img)
-        
-        profile.update(count=1, dtype=rasterio.uint8)
-        with rasterio.open(os.path.join(OUTPUT_DIR, f"classification_{year}.tif"), 'w', **profile) as dst:
-            dst.write(lc_data.astype(rasterio.uint8), 1)
+    # Years are independent, so spread them over the cores (results keep year order).
+    # No more workers than years; cores left over go to each worker's GDAL compression.
+    cpu_count = os.cpu_count() or 1
+    workers = min(cpu_count, len(years))
+    gdal_threads = max(1, cpu_count // workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(process_year_analysis, years, repeat(gdal_threads)))
+    urban_stats = [r for r in results if r is not None]
 
     # 4. Generate Change Map
     print("\nGenerating Change Map...")
@@ -144,20 +358,15 @@ def analyze_data():
         start_year = urban_stats[0][0]
         end_year = urban_stats[-1][0]
         
-        with rasterio.open(os.path.join(OUTPUT_DIR, f"classification_{start_year}.tif")) as src:
-            lc_start = src.read(1)
-        with rasterio.open(os.path.join(OUTPUT_DIR, f"classification_{end_year}.tif")) as src:
-            lc_end = src.read(1)
-            
-        change_map = np.zeros_like(lc_start)
-        # Highlight new urban areas
-        change_map[(lc_start != 6) & (lc_end == 6)] = 1
+        change_map = compute_change_map(
+            os.path.join(OUTPUT_DIR, f"classification_{start_year}.tif"),
+            os.path.join(OUTPUT_DIR, f"classification_{end_year}.tif"))
         
-        plt.figure(figsize=(10, 10))
-        plt.imshow(change_map, cmap='Reds', interpolation='nearest')
-        plt.title(f"Urban Expansion ({start_year}-{end_year})")
-        plt.axis('off')
-        plt.savefig(os.path.join(OUTPUT_DIR, "change_map.png"), bbox_inches='tight')
+        _reset_figure()
+        _AX.imshow(change_map, cmap='Reds', interpolation='nearest')
+        _AX.set_title(f"Urban Expansion ({start_year}-{end_year})")
+        _AX.axis('off')
+        _FIG.savefig(os.path.join(OUTPUT_DIR, "change_map.png"), bbox_inches='tight')
         print("Change map saved.")
 
     print("\nGenerating Report...")
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import main_analysis
+
+
+def write_classification(path, data, block=16):
+    profile = dict(driver='GTiff', width=data.shape[1], height=data.shape[0], count=1,
+                   dtype=rasterio.uint8, transform=from_origin(77.6, 13.1, 1e-4, 1e-4),
+                   tiled=True, blockxsize=block, blockysize=block)
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(data, 1)
+
+
+@pytest.mark.parametrize("max_plot_size", [1500, 20, 7], ids=["stride-1", "stride-2", "stride-6"])
+def test_change_map_matches_strided_full_mask(tmp_path, monkeypatch, max_plot_size):
+    monkeypatch.setattr(main_analysis, "MAX_PLOT_SIZE", max_plot_size)
+    rng = np.random.default_rng(1)
+    # Ragged size so the last row/column of blocks is partial
+    lc_start = rng.integers(0, 9, size=(45, 37), dtype=np.uint8)
+    lc_end = rng.integers(0, 9, size=(45, 37), dtype=np.uint8)
+    write_classification(str(tmp_path / "start.tif"), lc_start)
+    write_classification(str(tmp_path / "end.tif"), lc_end)
+
+    change_map = main_analysis.compute_change_map(str(tmp_path / "start.tif"), str(tmp_path / "end.tif"))
+
+    stride = main_analysis.display_stride(lc_start.shape)
+    expected = ((lc_start != 6) & (lc_end == 6)).astype(np.uint8)[::stride, ::stride]
+    assert change_map.dtype == np.uint8
+    np.testing.assert_array_equal(change_map, expected)
@@ -0,0 +1,151 @@
+import io
+import threading
+import time
+
+import pytest
+
+import download_data
+
+
+class FakeTask:
+    def __init__(self, active_polls=0, state='COMPLETED', error_message=None):
+        self.active_polls = active_polls
+        self.state = state
+        self.error_message = error_message
+        self.cancelled = False
+
+    def active(self):
+        if self.active_polls is None:  # Never finishes
+            return True
+        self.active_polls -= 1
+        return self.active_polls >= 0
+
+    def status(self):
+        status = {'state': self.state}
+        if self.error_message:
+            status['error_message'] = self.error_message
+        return status
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=b''):
+        self.status_code = status_code
+        self.raw = io.BytesIO(body)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class FakeCredentials:
+    def __init__(self):
+        self.valid = False
+        self.token = None
+        self.refreshes = 0
+
+    def refresh(self, request):
+        time.sleep(0.01)  # Widen the window for racing threads
+        self.refreshes += 1
+        self.token = f"token-{self.refreshes}"
+        self.valid = True
+
+
+@pytest.fixture
+def session_gets(monkeypatch):
+    """Record SESSION.get calls and answer them with a 200 carrying a small body."""
+    calls = []
+
+    def fake_get(url, headers=None, **kwargs):
+        calls.append({'url': url, 'headers': headers, **kwargs})
+        return fake_get.response
+
+    fake_get.response = FakeResponse(200, b'GeoTIFF bytes')
+    monkeypatch.setattr(download_data.SESSION, "get", fake_get)
+    return fake_get, calls
+
+
+@pytest.fixture
+def credentials(monkeypatch):
+    creds = FakeCredentials()
+    monkeypatch.setattr(download_data, "_EE_CREDENTIALS", creds)
+    return creds
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(download_data, "EXPORT_POLL_SECONDS", 0)
+
+
+def test_completed_export_is_downloaded_with_auth(tmp_path, session_gets, credentials):
+    _, calls = session_gets
+    target = tmp_path / "Sentinel2_2018.tif"
+
+    ok = download_data.download_export(FakeTask(active_polls=2), "my bucket", "Sentinel2 2018", str(target))
+
+    assert ok
+    assert target.read_bytes() == b'GeoTIFF bytes'
+    assert calls[0]['url'] == "https://storage.googleapis.com/my%20bucket/Sentinel2%202018.tif"
+    assert calls[0]['headers'] == {'Authorization': 'Bearer token-1'}
+    assert calls[0]['stream'] is True
+
+
+def test_stuck_export_times_out_and_is_cancelled(tmp_path, monkeypatch, session_gets, credentials):
+    _, calls = session_gets
+    monkeypatch.setattr(download_data, "EXPORT_TIMEOUT_SECONDS", 0)
+    task = FakeTask(active_polls=None)
+
+    assert not download_data.download_export(task, "bucket", "Sentinel2_2018", str(tmp_path / "x.tif"))
+    assert task.cancelled
+    assert calls == []
+
+
+def test_failed_export_is_not_downloaded(tmp_path, session_gets, credentials, capsys):
+    _, calls = session_gets
+    task = FakeTask(state='FAILED', error_message="User memory limit exceeded.")
+
+    assert not download_data.download_export(task, "bucket", "Sentinel2_2018", str(tmp_path / "x.tif"))
+    assert calls == []
+    assert "User memory limit exceeded." in capsys.readouterr().out
+
+
+def test_http_error_marks_download_failed(tmp_path, session_gets, credentials):
+    fake_get, _ = session_gets
+    fake_get.response = FakeResponse(403)
+    target = tmp_path / "x.tif"
+
+    assert not download_data.download_export(FakeTask(), "bucket", "Sentinel2_2018", str(target))
+    assert not target.exists()
+
+
+def test_export_start_failure_is_reported_as_failed(tmp_path):
+    assert not download_data.download_export(None, "bucket", "Sentinel2_2018", str(tmp_path / "x.tif"))
+
+
+def test_token_is_refreshed_once_across_threads(credentials):
+    headers = []
+    threads = [threading.Thread(target=lambda: headers.append(download_data.gcs_auth_headers()))
+               for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert credentials.refreshes == 1
+    assert headers == [{'Authorization': 'Bearer token-1'}] * 8
+
+
+def test_expired_token_is_refreshed(credentials):
+    download_data.gcs_auth_headers()
+    credentials.valid = False
+    assert download_data.gcs_auth_headers() == {'Authorization': 'Bearer token-2'}
+
+
+def test_auth_headers_require_init(monkeypatch):
+    monkeypatch.setattr(download_data, "_EE_CREDENTIALS", None)
+    with pytest.raises(RuntimeError):
+        download_data.gcs_auth_headers()
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+import main_analysis
+
+
+def reference_indices(img):
+    """Original float64 formulation: separate index arrays stacked with np.dstack."""
+    img = img.astype(np.float64)
+    epsilon = 1e-8
+    green, red, nir, swir1 = img[:, :, 1], img[:, :, 2], img[:, :, 3], img[:, :, 4]
+    ndvi = (nir - red) / (nir + red + epsilon)
+    ndbi = (swir1 - nir) / (swir1 + nir + epsilon)
+    mndwi = (green - swir1) / (green + swir1 + epsilon)
+    return np.dstack([img, ndvi, ndbi, mndwi])
+
+
+@pytest.fixture(params=[5, 6], ids=["5-band", "6-band"])
+def image(request):
+    rng = np.random.default_rng(0)
+    img = rng.uniform(0, 10000, size=(37, 53, request.param))
+    img[0, 0, :] = 0  # All-zero pixel exercises the epsilon guard
+    return img
+
+
+def check_matches_reference(features, img):
+    assert features.dtype == np.float32
+    assert features.shape == img.shape[:2] + (img.shape[2] + 3,)
+    np.testing.assert_allclose(features, reference_indices(img), rtol=1e-6, atol=1e-6)
+
+
+def test_numpy_path_matches_reference(image, monkeypatch):
+    monkeypatch.setattr(main_analysis, "USE_NUMBA", False)
+    check_matches_reference(main_analysis.calculate_indices(image), image)
+
+
+def test_numba_path_matches_reference(image):
+    if main_analysis._get_indices_kernel() is None:
+        pytest.skip("numba is not installed")
+    check_matches_reference(main_analysis.calculate_indices(image), image)
+
+
+def test_numba_and_numpy_paths_agree(image, monkeypatch):
+    if main_analysis._get_indices_kernel() is None:
+        pytest.skip("numba is not installed")
+    jit_features = main_analysis.calculate_indices(image)
+    monkeypatch.setattr(main_analysis, "USE_NUMBA", False)
+    numpy_features = main_analysis.calculate_indices(image)
+    np.testing.assert_allclose(jit_features, numpy_features, rtol=1e-6, atol=1e-6)
+
+
+def test_quantize_features_round_trip(image, monkeypatch):
+    monkeypatch.setattr(main_analysis, "USE_NUMBA", False)
+    features = main_analysis.calculate_indices(image)
+
+    q, scale, offset = main_analysis.quantize_features(features)
+
+    assert q.dtype == np.int8
+    assert q.shape == features.shape
+    restored = (q.astype(np.float32) - offset) / scale
+    assert np.all(np.abs(restored - features) <= 0.5 / scale + 1e-6)
+    # Reflectances 0..10000 span the whole int8 range
+    n_bands = image.shape[2]
+    assert q[0, 0, :n_bands].tolist() == [-128] * n_bands
+
+
+def test_quantize_features_saturates():
+    features = np.zeros((1, 2, 8), dtype=np.float32)
+    features[0, 0, :5] = 20000.0  # Above the reflectance range
+    features[0, 1, :5] = -500.0
+    features[0, 0, 5:] = 3.0      # Outside the index range
+    features[0, 1, 5:] = -3.0
+
+    q, _, _ = main_analysis.quantize_features(features)
+
+    assert q[0, 0].tolist() == [127] * 8
+    assert q[0, 1].tolist() == [-128] * 5 + [-128] * 3
@@ -0,0 +1,61 @@
+import os
+
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+
+import main_analysis
+
+
+def write_labels(path, data):
+    profile = dict(driver='GTiff', width=data.shape[1], height=data.shape[0], count=1,
+                   dtype=rasterio.uint8, transform=from_origin(77.6, 13.1, 1e-4, 1e-4))
+    with rasterio.open(path, 'w', **profile) as dst:
+        dst.write(data, 1)
+
+
+@pytest.fixture
+def output_dir(tmp_path, monkeypatch):
+    out = tmp_path / "results"
+    out.mkdir()
+    monkeypatch.setattr(main_analysis, "OUTPUT_DIR", str(out))
+    return out
+
+
+def test_cache_round_trip(tmp_path, output_dir):
+    labels = np.arange(6 * 7, dtype=np.uint8).reshape(6, 7) % 9
+    path = str(tmp_path / "LandCover_2018.tif")
+    write_labels(path, labels)
+
+    first, _ = main_analysis.load_landcover(path, 2018)
+    second, _ = main_analysis.load_landcover(path, 2018)
+    np.testing.assert_array_equal(first, labels)
+    np.testing.assert_array_equal(second, labels)
+    assert len(os.listdir(output_dir)) == 1
+
+
+def test_cache_is_keyed_on_source_path(tmp_path, output_dir):
+    # Same year, different data directories and raster sizes
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data_v2").mkdir()
+    v2 = np.full((4, 5), 6, dtype=np.uint8)
+    v1 = np.zeros((8, 3), dtype=np.uint8)
+    write_labels(str(tmp_path / "data_v2" / "LandCover_2018.tif"), v2)
+    write_labels(str(tmp_path / "data" / "LandCover_2018.tif"), v1)
+
+    got_v2, _ = main_analysis.load_landcover(str(tmp_path / "data_v2" / "LandCover_2018.tif"), 2018)
+    got_v1, profile = main_analysis.load_landcover(str(tmp_path / "data" / "LandCover_2018.tif"), 2018)
+    np.testing.assert_array_equal(got_v2, v2)
+    np.testing.assert_array_equal(got_v1, v1)
+    assert (profile['height'], profile['width']) == v1.shape
+
+
+def test_cache_with_wrong_shape_is_rebuilt(tmp_path, output_dir):
+    labels = np.ones((4, 5), dtype=np.uint8)
+    path = str(tmp_path / "LandCover_2018.tif")
+    write_labels(path, labels)
+    np.save(main_analysis.landcover_cache_path(path, 2018), np.zeros((2, 2), dtype=np.uint8))
+
+    data, _ = main_analysis.load_landcover(path, 2018)
+    np.testing.assert_array_equal(data, labels)